@@ -7,16 +7,23 @@ from __future__ import print_function
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import datetime
-from boto.ec2 import connect_to_region
 from collections import namedtuple
-import redis
-import argparse
-import logging
+from StringIO import StringIO
 import urllib2
+import base64
 import json
+import gzip
 import time
+import socket
+import threading
 import sys
-import re
+import os
+
+try:
+    # Optional: stream-parse the large AWS pricing JSON when available
+    import ijson
+except ImportError:
+    ijson = None
 
 SSH_PORT = 22
 REDIS_PORT = 6379
@@ -24,6 +31,12 @@ ALL_HOSTS = '0.0.0.0/0'
 
 # This URL and the mappings are from http://stackoverflow.com/questions/3636578/are-there-any-apis-for-amazon-web-services-pricing
 AWS_INSTANCE_PRICING_JSON_URL = 'http://aws.amazon.com/ec2/pricing/pricing-on-demand-instances.json'
+AWS_PRICING_CACHE_FILE = os.path.expanduser('~/.stormbench-prices.json')
+AWS_PRICING_CACHE_TTL = 86400
+
+# Short-lived on-disk cache for EC2 describe responses that rarely change
+EC2_CACHE_DIR = os.path.expanduser('~/.cache/stormbench')
+EC2_CACHE_TTL = 600
 
 AWS_PRICING_TYPES = {
     ('stdODI', 'sm'): 'm1.small',
@@ -42,6 +55,9 @@ AWS_PRICING_TYPES = {
     ('hiIoODI', 'xxxx1'): 'hi1.4xlarge',
 }
 
+# Precomputed type names so unknown entries are rejected with one set probe
+AWS_PRICING_TYPE_NAMES = frozenset(pricing_type for pricing_type, _size in AWS_PRICING_TYPES)
+
 AWS_PRICING_REGIONS = {
     'us-east' : 'us-east-1',
     'us-west-2' : 'us-west-2',
@@ -52,12 +68,87 @@ AWS_PRICING_REGIONS = {
     'sa-east-1' : 'sa-east-1',
 }
 
-InstanceRegistration = namedtuple('InstanceRegistration', ['id', 'type', 'started', 'stopped', 'elapsed', 'price'])
+# Monotonic clock for measuring elapsed time; immune to system clock jumps
+# mid-benchmark (falls back to time.time on Pythons without time.monotonic)
+_monotonic_time = getattr(time, 'monotonic', time.time)
+
+InstanceRegistration = namedtuple('InstanceRegistration', ['id', 'type', 'started', 'started_mono', 'stopped', 'elapsed', 'price'])
+
+def _parse_ab_timestamp(text):
+    """
+    Parse the fixed-width "YYYY-MM-DD HH:MM:SS ffffff..." timestamps the
+    clients log, slicing the known field offsets directly instead of
+    running strptime's format interpreter. The trailing nanosecond
+    digits are truncated to microseconds, like strptime %f did.
+    Returns None if the text does not fit the layout.
+    """
+    try:
+        return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                        int(text[11:13]), int(text[14:16]), int(text[17:19]),
+                        int(text[20:26]))
+    except ValueError:
+        return None
+
+_ec2_connections = {}
+
+def get_ec2_conn(args):
+    """
+    Return a cached EC2 connection for the given region and credentials.
+    Reusing one connection object keeps the underlying HTTPS connection
+    alive across API calls instead of redoing the TLS handshake for each.
+    """
+    # boto is imported lazily; it is slow to import and commands that never
+    # reach EC2 (usage errors, --help) should not pay for it
+    import boto
+    import logging
+    from boto.ec2 import connect_to_region
+    cache_key = (args.region, args.key)
+    if cache_key not in _ec2_connections:
+        # Silence boto's chatter without configuring the root logger; the
+        # raised level makes isEnabledFor fail fast, so log-call arguments
+        # are never even formatted on the API hot path
+        boto_logger = logging.getLogger('boto')
+        boto_logger.addHandler(logging.NullHandler())
+        boto_logger.propagate = False
+        boto_logger.setLevel(logging.CRITICAL + 1)
+        if not boto.config.has_section('Boto'):
+            boto.config.add_section('Boto')
+        boto.config.set('Boto', 'http_socket_timeout', '30')
+        _ec2_connections[cache_key] = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
+    return _ec2_connections[cache_key]
+
+def describe_in_parallel(args, jobs):
+    """
+    Run several independent EC2 describe calls concurrently and return
+    their results keyed by job name. boto connections are not thread
+    safe, so each worker thread opens its own connection (cheap compared
+    to the describe call itself). Exceptions are re-raised in the caller.
+    """
+    from boto.ec2 import connect_to_region
+    results = {}
+    errors = {}
+    def worker(name, job):
+        try:
+            conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
+            results[name] = job(conn)
+        except Exception as error:
+            errors[name] = error
+    threads = [threading.Thread(target=worker, args=job) for job in jobs.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[sorted(errors)[0]]
+    return results
 
 class PriceManager(object):
     """
     Calculate AWS prices based on the JSON data available online.
     """
+    # Parsed prices shared by all PriceManager instances in this process
+    _shared_prices = None
+
     def __init__(self, region):
         self.region = region
         self._instances = {}
@@ -75,42 +166,80 @@ class PriceManager(object):
     
     def _load_aws_prices(self):
         """
-        Load prices from Amazon's JSON data
+        Load prices from Amazon's JSON data.
+        The parsed prices are cached on disk for a day and shared between
+        PriceManager instances, so the slow download only happens once.
         """
+        if PriceManager._shared_prices is not None:
+            self._cached_prices = PriceManager._shared_prices
+            return
+        try:
+            if os.path.getmtime(AWS_PRICING_CACHE_FILE) > time.time() - AWS_PRICING_CACHE_TTL:
+                with open(AWS_PRICING_CACHE_FILE) as cache_file:
+                    self._cached_prices = json.load(cache_file)
+                PriceManager._shared_prices = self._cached_prices
+                return
+        except (OSError, IOError, ValueError):
+            # Missing or unreadable cache file, download a fresh copy
+            pass
         self._cached_prices = {}
-        prices = json.load(urllib2.urlopen(AWS_INSTANCE_PRICING_JSON_URL))
-        for original_region_data in prices.get('config', {}).get('regions', []):
+        request = urllib2.Request(AWS_INSTANCE_PRICING_JSON_URL, headers={'Accept-Encoding': 'gzip'})
+        response = urllib2.urlopen(request)
+        data = response.read()
+        if response.info().get('Content-Encoding') == 'gzip':
+            data = gzip.GzipFile(fileobj=StringIO(data)).read()
+        if ijson:
+            # Stream the region entries one by one instead of building the
+            # full document tree in memory; unknown regions are discarded
+            # without ever allocating their instanceTypes subtrees.
+            region_entries = ijson.items(StringIO(data), 'config.regions.item')
+        else:
+            region_entries = json.loads(data).get('config', {}).get('regions', [])
+        for original_region_data in region_entries:
             region_name = AWS_PRICING_REGIONS.get(original_region_data.get('region', ''), '')
             if region_name:
                 # Known region in our maps, read the instance entries.
                 region_prices = {}
                 for original_instance_data in original_region_data.get('instanceTypes', []):
                     original_type = original_instance_data.get('type', '')
+                    if original_type not in AWS_PRICING_TYPE_NAMES:
+                        # Unknown type, skip without scanning its sizes
+                        continue
                     for original_entry in original_instance_data.get('sizes', []):
                         original_size = original_entry.get('size', '')
-                        instance_type = AWS_PRICING_TYPES.get((original_type, original_size), '')
-                        if instance_type:
-                            for original_value_column in original_entry.get('valueColumns', []):
-                                if original_value_column.get('name', '') == 'linux':
-                                    try: price = float(original_value_column.get('prices', {}).get('USD', '0.0'))
-                                    except: price = 0.0
-                                    if price:
-                                        region_prices[instance_type] = price
+                        instance_type = AWS_PRICING_TYPES.get((original_type, original_size))
+                        if not instance_type:
+                            continue
+                        linux_column = next((column for column in original_entry.get('valueColumns', []) if column.get('name', '') == 'linux'), None)
+                        if linux_column:
+                            try: price = float(linux_column.get('prices', {}).get('USD', '0.0'))
+                            except: price = 0.0
+                            if price:
+                                region_prices[instance_type] = price
                 self._cached_prices[region_name] = region_prices
-    
+        PriceManager._shared_prices = self._cached_prices
+        try:
+            # Atomically replace the cache file with the parsed prices
+            with open(AWS_PRICING_CACHE_FILE + '.tmp', 'w') as cache_file:
+                json.dump(self._cached_prices, cache_file)
+            os.rename(AWS_PRICING_CACHE_FILE + '.tmp', AWS_PRICING_CACHE_FILE)
+        except (OSError, IOError):
+            # The cache is only an optimization, ignore write failures
+            pass
+
     def track(self, instance):
-        self._instances[instance.id] = InstanceRegistration(id=instance.id, type=instance.instance_type, started=datetime.now(), stopped=None, elapsed=0, price=0)
-    
+        self._instances[instance.id] = InstanceRegistration(id=instance.id, type=instance.instance_type, started=datetime.now(), started_mono=_monotonic_time(), stopped=None, elapsed=0, price=0)
+
     def untrack(self, instance):
         if hasattr(instance, 'id'):
             instance = instance.id
         if instance in self._instances:
             reg = self._instances[instance]
             del self._instances[instance]
-            now = datetime.now()
-            elapsed = (now - reg.started).total_seconds()
+            # Elapsed time comes from the monotonic clock; wall time is only kept for display
+            elapsed = _monotonic_time() - reg.started_mono
             price = float(elapsed * self.get_instance_price(reg.type)) / float(3600)
-            self._costs.append(InstanceRegistration(id=reg.id, type=reg.type, started=reg.started, stopped=now, elapsed=elapsed, price=price))
+            self._costs.append(InstanceRegistration(id=reg.id, type=reg.type, started=reg.started, started_mono=reg.started_mono, stopped=datetime.now(), elapsed=elapsed, price=price))
     
     def report(self):
         total_price = 0.0
@@ -133,28 +262,67 @@ UBUNTU_IMAGES = {
     'us-west-2': 'ami-8c109ebc',
 }
 
+# Valid --type and --region values, derived from the tables above so a
+# typo is rejected locally instead of failing after a slow EC2 call
+INSTANCE_TYPES = frozenset(AWS_PRICING_TYPES.values())
+REGIONS = frozenset(UBUNTU_IMAGES)
+
 COMMON_USER_DATA = '#!/bin/sh\n' + \
     'apt-get update >>/tmp/stormbench.log 2>&1\n' + \
     'DEBIAN_FRONTEND=noninteractive apt-get dist-upgrade -q -y >>/tmp/stormbench.log 2>&1\n' + \
     'DEBIAN_FRONTEND=noninteractive apt-get install -q -y apache2-utils redis-server >>/tmp/stormbench.log 2>&1\n' + \
     'echo "StormBench initialization done." >> /tmp/stormbench.log\n'
 
+# The user-data shell scripts are assembled once at import into .format
+# templates, so each make_* call is a single format pass instead of a
+# chain of %-interpolated concatenations
+_SERVER_USER_DATA = COMMON_USER_DATA + \
+    'grep -q "bind 0.0.0.0" /etc/redis/redis.conf || echo "bind 0.0.0.0" >> /etc/redis/redis.conf\n' + \
+    '/etc/init.d/redis-server restart\n'
+
+_IMAGE_USER_DATA_TEMPLATE = COMMON_USER_DATA + \
+    '/usr/bin/redis-cli -h "{server_address}" hset clients "`ec2metadata --instance-id`" "`ec2metadata --local-hostname`" >> /tmp/stormbench.log 2>&1\n' + \
+    '/usr/bin/redis-cli -h "{server_address}" rpush registered "`ec2metadata --instance-id`" >> /tmp/stormbench.log 2>&1\n'
+
+_CLIENT_USER_DATA_TEMPLATE = COMMON_USER_DATA + \
+    '/usr/bin/redis-cli -h "{server_address}" hset clients "`ec2metadata --instance-id`" "`ec2metadata --local-hostname`" >> /tmp/stormbench.log 2>&1\n' + \
+    '/usr/bin/redis-cli -h "{server_address}" rpush registered "`ec2metadata --instance-id`" >> /tmp/stormbench.log 2>&1\n' + \
+    '/usr/bin/redis-cli -h "{server_address}" blpop trigger_list 0 >> /tmp/stormbench.log 2>&1\n' + \
+    'date +"Start-Time: %Y-%m-%d %H:%M:%S %N" > /tmp/ab.log\n' + \
+    '{ab_command_line} >> /tmp/ab.log 2>&1\n' + \
+    'date +"End-Time: %Y-%m-%d %H:%M:%S %N" >> /tmp/ab.log\n' + \
+    '/usr/bin/redis-cli -h "{server_address}" hset results "`ec2metadata --instance-id`" "`cat /tmp/ab.log`" >> /tmp/stormbench.log 2>&1\n' + \
+    '/usr/bin/redis-cli -h "{server_address}" rpush results_ready "`ec2metadata --instance-id`" >> /tmp/stormbench.log 2>&1\n'
+
+def pack_user_data(script):
+    """
+    Wrap a user-data shell script in a gzip+base64 self-extracting
+    stub. EC2 uploads the user data with every RunInstances call and
+    caps it at 16KB; the scripts are repetitive shell text that
+    compresses to a fraction of its size, which both shrinks the
+    request and leaves headroom for richer provisioning.
+    """
+    buffer = StringIO()
+    compressed = gzip.GzipFile(fileobj=buffer, mode='wb')
+    compressed.write(script)
+    compressed.close()
+    # base64 output contains no shell metacharacters, so no quoting needed
+    payload = base64.b64encode(buffer.getvalue())
+    return '#!/bin/sh\necho %s | base64 -d | gunzip | /bin/sh\n' % payload
+
 def make_server_user_data():
     """
     Generate user data for a Redis server instance.
     """
     # Additional configuration to open Redis server to world
-    return COMMON_USER_DATA + \
-        'grep -q "bind 0.0.0.0" /etc/redis/redis.conf || echo "bind 0.0.0.0" >> /etc/redis/redis.conf\n' + \
-        '/etc/init.d/redis-server restart\n'
+    return pack_user_data(_SERVER_USER_DATA)
 
 def make_image_user_data(server_address):
     """
     Generate user data for a temporary image instance.
     This will register the client on the Redis server.
     """
-    return COMMON_USER_DATA + \
-        '/usr/bin/redis-cli -h "%s" hset clients "`ec2metadata --instance-id`" "`ec2metadata --local-hostname`" >> /tmp/stormbench.log 2>&1\n' % (server_address)
+    return pack_user_data(_IMAGE_USER_DATA_TEMPLATE.format(server_address=server_address))
 
 def make_client_user_data(server_address, ab_command_line):
     """
@@ -162,13 +330,56 @@ def make_client_user_data(server_address, ab_command_line):
     This will register the client on the Redis server, wait for the trigger, perform the ApacheBench run and then submit the results.
     Note: Uses nonstandard %N (nanosecond) field for date.
     """
-    return COMMON_USER_DATA + \
-        '/usr/bin/redis-cli -h "%s" hset clients "`ec2metadata --instance-id`" "`ec2metadata --local-hostname`" >> /tmp/stormbench.log 2>&1\n' % (server_address) + \
-        'while ! /usr/bin/redis-cli -h "%s" exists trigger | grep -q 1; do sleep 1; done\n' % (server_address) + \
-        'date +"Start-Time: %Y-%m-%d %H:%M:%S %N" > /tmp/ab.log\n' + \
-        ab_command_line + ' >> /tmp/ab.log 2>&1\n' + \
-        'date +"End-Time: %Y-%m-%d %H:%M:%S %N" >> /tmp/ab.log\n' + \
-        '/usr/bin/redis-cli -h "%s" hset results "`ec2metadata --instance-id`" "`cat /tmp/ab.log`" >> /tmp/stormbench.log 2>&1\n' % (server_address)
+    return pack_user_data(_CLIENT_USER_DATA_TEMPLATE.format(server_address=server_address, ab_command_line=ab_command_line))
+
+def _cache_path(key):
+    return os.path.join(EC2_CACHE_DIR, key + '.json')
+
+# In-process memo over the disk cache, so commands that resolve the same
+# key several times in one run pay for the disk read (or describe) once
+_cache_memory = {}
+
+def _cache_get(key, ttl, loader):
+    """
+    Return the cached value for key if it is fresher than ttl seconds.
+    Otherwise call loader(), store its JSON-serializable result on disk
+    and return it. Cache trouble of any kind just falls through to the
+    loader, so a broken cache directory costs nothing but the speedup.
+    """
+    if key in _cache_memory:
+        return _cache_memory[key]
+    path = _cache_path(key)
+    try:
+        if os.path.getmtime(path) > time.time() - ttl:
+            with open(path) as cache_file:
+                value = json.load(cache_file)
+            _cache_memory[key] = value
+            return value
+    except (OSError, IOError, ValueError):
+        pass
+    value = loader()
+    _cache_memory[key] = value
+    try:
+        if not os.path.isdir(EC2_CACHE_DIR):
+            os.makedirs(EC2_CACHE_DIR)
+        with open(path + '.tmp', 'w') as cache_file:
+            json.dump(value, cache_file)
+        os.rename(path + '.tmp', path)
+    except (OSError, IOError):
+        pass
+    return value
+
+def _cache_invalidate(*keys):
+    """
+    Drop cached describe responses after mutating the resources they
+    cover, so the next invocation sees the change immediately.
+    """
+    for key in keys:
+        _cache_memory.pop(key, None)
+        try:
+            os.remove(_cache_path(key))
+        except OSError:
+            pass
 
 def create_security_group(ec2_conn, args):
     """
@@ -178,35 +389,89 @@ def create_security_group(ec2_conn, args):
     if args.group != 'stormbench':
         print('Not creating nondefault security group %s' % args.group)
         return
-    try:
-        if ec2_conn.get_all_security_groups(groupnames=[args.group]):
-            print('Security group %s exists, good.' % args.group)
-            return
-    except:
-        # Expecting a EC2ResponseError of group not found
-        pass
-    print('Creating security group %s...' % args.group)
-    group = ec2_conn.create_security_group(args.group, 'StormBench access group')
-    group.authorize(ip_protocol='tcp', from_port=SSH_PORT, to_port=SSH_PORT, cidr_ip=ALL_HOSTS)
-    group.authorize(ip_protocol='tcp', from_port=REDIS_PORT, to_port=REDIS_PORT, cidr_ip=ALL_HOSTS)
+    def probe_or_create():
+        try:
+            if ec2_conn.get_all_security_groups(groupnames=[args.group]):
+                print('Security group %s exists, good.' % args.group)
+                return True
+        except:
+            # Expecting a EC2ResponseError of group not found
+            pass
+        print('Creating security group %s...' % args.group)
+        group = ec2_conn.create_security_group(args.group, 'StormBench access group')
+        group.authorize(ip_protocol='tcp', from_port=SSH_PORT, to_port=SSH_PORT, cidr_ip=ALL_HOSTS)
+        group.authorize(ip_protocol='tcp', from_port=REDIS_PORT, to_port=REDIS_PORT, cidr_ip=ALL_HOSTS)
+        return True
+    # The group only ever needs creating once, so its existence is cached
+    # and warm invocations skip the DescribeSecurityGroups round-trip.
+    # The key includes the access key because groups are account-specific.
+    _cache_get('group-%s-%s-%s' % (args.region, args.key, args.group), EC2_CACHE_TTL, probe_or_create)
+
+def wait_for_state(obj, target_state, initial_delay=2, max_delay=30):
+    """
+    Wait until the EC2 object reaches the target state, polling with an
+    exponentially increasing delay. State changes take from tens of
+    seconds (instances) to minutes (AMIs), so backing off from a short
+    initial delay issues far fewer describe calls over a long wait than
+    a fixed interval, without slowing down quick transitions.
+    """
+    delay = initial_delay
+    started = _monotonic_time()
+    waited = False
+    while obj.state != target_state:
+        # Rewrite one status line in place instead of growing a dot trail;
+        # a single line is also kinder to scrolled or scraped logs
+        sys.stdout.write('\r    %s, waiting for %s (%ds elapsed)' % (obj.state, target_state, _monotonic_time() - started))
+        sys.stdout.flush()
+        waited = True
+        time.sleep(delay)
+        delay = min(max_delay, delay * 1.5)
+        obj.update()
+    if waited:
+        # Blank the status line so the caller's report starts clean
+        sys.stdout.write('\r' + ' ' * 60 + '\r')
+
+def refresh_instance_states(ec2_conn, instances):
+    """
+    Refresh the state of the specified instances with a single
+    DescribeInstances call instead of one update() call per instance.
+    """
+    states = {}
+    for reservation in ec2_conn.get_all_instances(instance_ids=[instance.id for instance in instances]):
+        for updated_instance in reservation.instances:
+            states[updated_instance.id] = updated_instance.state
+    for instance in instances:
+        if instance.id in states:
+            instance._state.name = states[instance.id]
 
 def terminate_instances(ec2_conn, instances, price_manager=None):
     if not instances:
         return
-    print('Terminating instances: %s..' % (' '.join([instance.id for instance in instances])), end='')
-    sys.stdout.flush()
-    for instance in instances:
-        instance.terminate()
-        if price_manager:
+    instance_ids = [instance.id for instance in instances]
+    print('Terminating instances: %s...' % (' '.join(instance_ids)))
+    # One TerminateInstances call covers the whole list, instead of one
+    # API round-trip per instance
+    ec2_conn.terminate_instances(instance_ids=instance_ids)
+    if price_manager:
+        for instance in instances:
             price_manager.untrack(instance)
-    while [instance for instance in instances if instance.state != 'terminated']:
-        print('.', end='')
+    # Track only the still-pending instances so each poll describes and
+    # scans just the ones that have not terminated yet
+    pending = dict((instance.id, instance) for instance in instances if instance.state != 'terminated')
+    delay = 1
+    started = _monotonic_time()
+    while pending:
+        # Rewrite one status line in place instead of growing a dot trail
+        sys.stdout.write('\r    %d instance(s) still shutting down (%ds elapsed)' % (len(pending), _monotonic_time() - started))
         sys.stdout.flush()
-        time.sleep(1)
-        for instance in instances:
-            if instance.state != 'terminated':
-                instance.update()
-    print(' All terminated.')
+        time.sleep(delay)
+        delay = min(30, delay * 1.5)
+        refresh_instance_states(ec2_conn, list(pending.values()))
+        for instance_id in list(pending):
+            if pending[instance_id].state == 'terminated':
+                del pending[instance_id]
+    sys.stdout.write('\r' + ' ' * 60 + '\r')
+    print('All terminated.')
 
 def auto_choose_ami(ec2_conn, args):
     """
@@ -214,14 +479,17 @@ def auto_choose_ami(ec2_conn, args):
     """
     if args.ami:
         return
-    # Try to find existing image.
+    # Try to find existing image. Only the (id, name) pairs are cached on
+    # disk, so repeated invocations skip the slow DescribeImages call
+    # Keyed by account as well as region, since the listing is owners=self
+    images = _cache_get('images-%s-%s' % (args.region, args.key), EC2_CACHE_TTL,
+                        lambda: [[image.id, image.name] for image in ec2_conn.get_all_images(owners=['self'], filters={'tag:StormBench':'True'})])
     prev_name = ''
-    for image in ec2_conn.get_all_images(owners=['self'], filters={'tag:StormBench':'True'}):
-        if image.tags['StormBench'] == 'True':
-            # Find image with latest name (sorted by date suffix)
-            if image.name > prev_name:
-                args.ami = image.id
-                prev_name = image.name
+    for image_id, image_name in images:
+        # Find image with latest name (sorted by date suffix)
+        if image_name > prev_name:
+            args.ami = image_id
+            prev_name = image_name
     if args.ami:
         print('Using custom AMI image %s %s' % (args.ami, prev_name))
         return
@@ -257,17 +525,13 @@ def launch_redis_server(ec2_conn, args, price_manager=None):
     # It can take a moment for the instance id to be available
     time.sleep(10)
     print('Tagging server instance %s as %s' % (instance.id, tag))
-    instance.add_tag('StormBench', 'True')
-    instance.add_tag('StormBenchRole', 'Server')
-    instance.add_tag('Name', tag)
-    print('Waiting for server instance %s to start up..' % instance.id, end='')
-    sys.stdout.flush()
-    while instance.state != 'running':
-        print('.', end='')
-        sys.stdout.flush()
-        instance.update()
-        time.sleep(5)
-    print(' %s %s %s' % (instance.state, instance.public_dns_name, instance.private_dns_name))
+    # Apply all tags with a single CreateTags API call
+    ec2_conn.create_tags([instance.id], {'StormBench': 'True', 'StormBenchRole': 'Server', 'Name': tag})
+    print('Waiting for server instance %s to start up...' % instance.id)
+    # Instances rarely reach 'running' before ~30s, so start polling late
+    # and keep the interval short around the expected transition window
+    wait_for_state(instance, 'running', initial_delay=5, max_delay=15)
+    print('%s %s %s' % (instance.state, instance.public_dns_name, instance.private_dns_name))
     return instance.public_dns_name
 
 def terminate_redis_server(ec2_conn, args, price_manager=None):
@@ -293,44 +557,92 @@ class RedisManager(object):
     """
     
     def __init__(self, server_address):
-        print('Connecting to Redis server at %s...' % server_address, end='')
-        sys.stdout.flush()
-        self.redis_client = redis.StrictRedis(host=server_address)
+        # redis is imported lazily so commands that never touch the Redis
+        # server (like status) start up without it
+        import redis
+        print('Connecting to Redis server at %s...' % server_address)
+        keepalive_options = {}
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            # Linux-only constants; keep idle polling connections alive across NAT timeouts
+            keepalive_options = {socket.TCP_KEEPIDLE: 60, socket.TCP_KEEPINTVL: 10, socket.TCP_KEEPCNT: 3}
+        # One explicitly sized pool backs every Redis call this manager
+        # makes, so sockets are reused instead of being set up per burst
+        self.pool = redis.ConnectionPool(host=server_address, max_connections=32, decode_responses=True, socket_connect_timeout=2, socket_keepalive=True, socket_keepalive_options=keepalive_options)
+        self.redis_client = redis.StrictRedis(connection_pool=self.pool)
+        started = _monotonic_time()
         while True:
             try:
-                self.redis_client.incr('connections')
+                # PING is a cheap read-only readiness probe; unlike a write
+                # it costs the server no AOF/replication work
+                self.redis_client.ping()
                 break
-            except redis.exceptions.ConnectionError:
-                print('.', end='')
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+                # TimeoutError is not a ConnectionError subclass, and a
+                # booting server that drops SYNs surfaces as a connect
+                # timeout; both just mean "not ready yet"
+                # Rewrite one status line in place instead of a dot trail
+                sys.stdout.write('\r    not answering yet (%ds elapsed)' % (_monotonic_time() - started))
                 sys.stdout.flush()
                 time.sleep(5)
-        print(' Connected.')
+        sys.stdout.write('\r' + ' ' * 60 + '\r')
+        print('Connected.')
     
     def reset_data(self):
-        self.redis_client.delete('clients', 'results', 'trigger')
+        self.redis_client.delete('clients', 'results', 'trigger', 'trigger_list', 'registered', 'results_ready')
     
     def wait_for_clients(self, client_instance_ids):
         """
         Wait for the specified clients to register on the Redis server.
         """
         print('Waiting for %d client(s) to register on Redis server...' % len(client_instance_ids))
-        remaining_clients = list(client_instance_ids)
+        # Clients push their id onto the 'registered' list after HSET, so
+        # the tokens persist; a client that beat us here is still counted
+        remaining_clients = self._unregistered('clients', set(client_instance_ids))
         while remaining_clients:
-            for client_instance_id in remaining_clients:
-                if self.redis_client.hexists('clients', client_instance_id):
-                    remaining_clients.remove(client_instance_id)
-                    print('\r%d client(s) remaining' % len(remaining_clients))
-                    sys.stdout.flush()
-            if remaining_clients:
-                time.sleep(5)
+            reply = self.redis_client.brpop('registered', timeout=30)
+            if reply:
+                remaining_clients.discard(reply[1])
+            else:
+                # Timed out without notifications, fall back to a snapshot
+                remaining_clients = self._unregistered('clients', remaining_clients)
+            print('\r%d client(s) remaining' % len(remaining_clients))
+            sys.stdout.flush()
         print('All %d client(s) registered.' % len(client_instance_ids))
-    
+
+    def _unregistered(self, hash_key, remaining_clients):
+        """
+        Return the subset of remaining_clients with no field in hash_key
+        yet. One HMGET on the outstanding ids fetches exactly what we need
+        in a single round-trip, instead of pulling the whole hash back.
+        """
+        probe_ids = list(remaining_clients)
+        values = self.redis_client.hmget(hash_key, probe_ids)
+        return set(client_id for client_id, value in zip(probe_ids, values) if value is None)
+
     def parse_ab_result(self, text):
-        return dict([[f.strip() for f in line.split(':', 1)] for line in text.replace('\r', '').split('\n') if line.find(':') > 0])
+        # splitlines handles \r\n without copying the whole buffer first,
+        # and partition finds the separator and splits in a single scan
+        result = {}
+        for line in text.splitlines():
+            key, separator, value = line.partition(':')
+            if separator and key:
+                result[key.strip()] = value.strip()
+        return result
     
-    def trigger(self):
+    def trigger(self, client_count=1):
+        """
+        Fire the benchmark trigger for the specified number of clients.
+        Any stale results are wiped, the trigger timestamp is recorded and
+        one wakeup token per client is pushed onto trigger_list, all in a
+        single pipelined round-trip. Each client blocks on BLPOP and wakes
+        up the moment its token arrives, so all clients start together.
+        """
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.redis_client.set('trigger', now)
+        pipe = self.redis_client.pipeline()
+        pipe.delete('results', 'results_ready')
+        pipe.set('trigger', now)
+        pipe.rpush('trigger_list', *([now] * client_count))
+        pipe.execute()
         print('Benchmark triggered at %s!' % now)
     
     def wait_for_results(self, client_instance_ids):
@@ -339,43 +651,58 @@ class RedisManager(object):
         """
         print('Waiting for %d client(s) to submit results to Redis server...' % len(client_instance_ids))
         results = {}
-        remaining_clients = list(client_instance_ids)
+        remaining_clients = set(client_instance_ids)
         while remaining_clients:
-            for client_instance_id in remaining_clients:
-                if self.redis_client.hexists('results', client_instance_id):
-                    results[client_instance_id] = self.parse_ab_result(self.redis_client.hget('results', client_instance_id))
-                    remaining_clients.remove(client_instance_id)
-                    print('\r%d client(s) remaining' % len(remaining_clients))
-                    sys.stdout.flush()
-            if remaining_clients:
-                time.sleep(5)
+            reply = self.redis_client.brpop('results_ready', timeout=30)
+            if reply and reply[1] in remaining_clients:
+                # Woken by a specific client; fetch just its payload
+                value = self.redis_client.hget('results', reply[1])
+                if value is not None:
+                    results[reply[1]] = self.parse_ab_result(value)
+                    remaining_clients.discard(reply[1])
+                continue
+            if reply:
+                continue
+            # Timed out without tokens; one HMGET on the outstanding ids
+            # catches anything whose token was lost
+            probe_ids = list(remaining_clients)
+            for client_instance_id, value in zip(probe_ids, self.redis_client.hmget('results', probe_ids)):
+                if value is not None:
+                    results[client_instance_id] = self.parse_ab_result(value)
+                    remaining_clients.discard(client_instance_id)
+            print('\r%d client(s) remaining' % len(remaining_clients))
+            sys.stdout.flush()
         print('All %d client(s) submitted results.' % len(client_instance_ids))
         return results
     
     def print_results(self, results):
-        total_bit_rate = 0
-        total_req_rate = 0
-        valid_result_count = 0
+        # Parse into parallel arrays first, then aggregate and print from
+        # them; the totals become plain sum() reductions over flat float
+        # lists instead of accumulator updates mixed into parsing
+        rows = []
+        bit_rates = []
+        req_rates = []
         invalid_result_count = 0
         for key, result in results.items():
             start_time_text = result.get('Start-Time', '')
             end_time_text = result.get('End-Time', '')
             rate_text = result.get('Transfer rate', '') # 1130.58 [Kbytes/sec] received
             rps_text = result.get('Requests per second', '') # 2.73 [#/sec] (mean)
-            if start_time_text and end_time_text and ' ' in rate_text and ' ' in rps_text:
-                # Parse result fields in more detail
-                start_time = datetime.strptime(start_time_text[:26], '%Y-%m-%d %H:%M:%S %f') # 2012-12-31 23:59:59 999999999
-                end_time = datetime.strptime(end_time_text[:26], '%Y-%m-%d %H:%M:%S %f')
+            start_time = _parse_ab_timestamp(start_time_text)
+            end_time = _parse_ab_timestamp(end_time_text)
+            if start_time and end_time and ' ' in rate_text and ' ' in rps_text:
                 kbyte_rate_text, _rest = rate_text.split(' ', 1)
-                bit_rate = float(kbyte_rate_text) * 1024 * 8
                 req_rate_text, _rest = rps_text.split(' ', 1)
-                req_rate = float(req_rate_text)
-                total_bit_rate += bit_rate
-                total_req_rate += req_rate
-                print('%s: %.2f Mbit/s (%s) %.02f req/s (%s) %s - %s' % (key, bit_rate/1024/1024, kbyte_rate_text, req_rate, req_rate_text, start_time.isoformat(), end_time.isoformat()))
-                valid_result_count += 1
+                rows.append((key, kbyte_rate_text, req_rate_text, start_time, end_time))
+                bit_rates.append(float(kbyte_rate_text) * 1024 * 8)
+                req_rates.append(float(req_rate_text))
             else:
                 invalid_result_count += 1
+        total_bit_rate = sum(bit_rates)
+        total_req_rate = sum(req_rates)
+        valid_result_count = len(rows)
+        for (key, kbyte_rate_text, req_rate_text, start_time, end_time), bit_rate, req_rate in zip(rows, bit_rates, req_rates):
+            print('%s: %.2f Mbit/s (%s) %.02f req/s (%s) %s - %s' % (key, bit_rate/1024/1024, kbyte_rate_text, req_rate, req_rate_text, start_time.isoformat(), end_time.isoformat()))
         print('------------------------------------------------------------')
         print('Total transfer rate: %.2f Mbit/s' % (total_bit_rate/1024/1024))
         print('Average transfer rate: %.2f Mbit/s' % (total_bit_rate/1024/1024/valid_result_count if valid_result_count else 0.0))
@@ -385,339 +712,476 @@ class RedisManager(object):
         print('%d valid result(s)' % (valid_result_count))
         print('%d invalid result(s)' % (invalid_result_count))
 
-class Commands(object):
-    """
-    This class contains all the command line commands as methods.
-    """
+def startserver(args):
+    ec2_conn = get_ec2_conn(args)
+    auto_choose_ami(ec2_conn, args)
+    create_security_group(ec2_conn, args)
+    server_address = launch_redis_server(ec2_conn, args)
+    # Connect to the newly launched server and wait for connection.
+    redis_manager = RedisManager(server_address)
+    redis_manager.reset_data()
+
+def stopserver(args):
+    ec2_conn = get_ec2_conn(args)
+    terminate_redis_server(ec2_conn, args)
+
+def createimage(args):
+    now = datetime.now().strftime('%Y%m%d-%H%M%S')
+    tag = args.prefix + '-' + now
+    temp_tag = args.prefix + '-image'
+    print('Creating new AMI image...')
+    print('    Account: %s' % args.key)
+    print('    Region: %s' % args.region)
+    print('    Instance type: %s' % args.type)
+    print('    AMI image name/tag: %s' % tag)
+    print('    Temporary instance tag: %s' % temp_tag)
+    print('    Temporary instance keypair: %s' % args.keypair)
+    print('    Temporary instance security group: %s' % args.group)
+    price_manager = PriceManager(args.region)
+    ec2_conn = get_ec2_conn(args)
+    auto_choose_ami(ec2_conn, args)
+    create_security_group(ec2_conn, args)
+    server_address = launch_redis_server(ec2_conn, args, price_manager)
     
-    def startserver(self, args):
-        ec2_conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
-        auto_choose_ami(ec2_conn, args)
-        create_security_group(ec2_conn, args)
-        server_address = launch_redis_server(ec2_conn, args)
-        # Connect to the newly launched server and wait for connection.
-        redis_manager = RedisManager(server_address)
-        redis_manager.reset_data()
+    # Connect to the newly launched server and wait for connection.
+    redis_manager = RedisManager(server_address)
+    redis_manager.reset_data()
     
-    def stopserver(self, args):
-        ec2_conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
-        terminate_redis_server(ec2_conn, args)
+    # Now actually start the temporary instance for image creation.
+    print('Starting image creation...')
+    user_data = make_image_user_data(server_address)
+    reservation = ec2_conn.run_instances(image_id=args.ami, instance_type=args.type, user_data=user_data, key_name=args.keypair, security_groups=[args.group])
+    # There can be a delay before AWS knows about the new instance ID
+    time.sleep(10)
+    instance = reservation.instances[0]
+    price_manager.track(instance)
+    print('Tagging temporary instance %s as %s' % (instance.id, temp_tag))
+    # Apply all tags with a single CreateTags API call
+    ec2_conn.create_tags([instance.id], {'StormBench': 'True', 'StormBenchRole': 'Temporary', 'Name': temp_tag})
+    print('Waiting for temporary instance %s to start...' % (instance.id))
+    wait_for_state(instance, 'running', initial_delay=5, max_delay=15)
+    print('%s %s %s' % (instance.state, instance.public_dns_name, instance.private_dns_name))
     
-    def createimage(self, args):
-        now = datetime.now().strftime('%Y%m%d-%H%M%S')
-        tag = args.prefix + '-' + now
-        temp_tag = args.prefix + '-image'
-        print('Creating new AMI image...')
-        print('    Account: %s' % args.key)
-        print('    Region: %s' % args.region)
-        print('    Instance type: %s' % args.type)
-        print('    AMI image name/tag: %s' % tag)
-        print('    Temporary instance tag: %s' % temp_tag)
-        print('    Temporary instance keypair: %s' % args.keypair)
-        print('    Temporary instance security group: %s' % args.group)
-        price_manager = PriceManager(args.region)
-        ec2_conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
-        auto_choose_ami(ec2_conn, args)
-        create_security_group(ec2_conn, args)
-        server_address = launch_redis_server(ec2_conn, args, price_manager)
-        
-        # Connect to the newly launched server and wait for connection.
-        redis_manager = RedisManager(server_address)
-        redis_manager.reset_data()
-        
-        # Now actually start the temporary instance for image creation.
-        print('Starting image creation...')
-        user_data = make_image_user_data(server_address)
-        reservation = ec2_conn.run_instances(image_id=args.ami, instance_type=args.type, user_data=user_data, key_name=args.keypair, security_groups=[args.group])
-        # There can be a delay before AWS knows about the new instance ID
-        time.sleep(10)
-        instance = reservation.instances[0]
-        price_manager.track(instance)
-        print('Tagging temporary instance %s as %s' % (instance.id, temp_tag))
-        instance.add_tag('StormBench', 'True')
-        instance.add_tag('StormBenchRole', 'Temporary')
-        instance.add_tag('Name', temp_tag)
-        print('Waiting for temporary instance %s to start..' % (instance.id), end='')
-        sys.stdout.flush()
-        while instance.state != 'running':
-            print('.', end='')
-            sys.stdout.flush()
-            instance.update()
-            time.sleep(5)
-        print(' %s %s %s' % (instance.state, instance.public_dns_name, instance.private_dns_name))
-        
-        # Wait for the client to register on the Redis server.
-        redis_manager.wait_for_clients([instance.id])
-        
-        # Now we can create the AMI image.
-        image_id = ec2_conn.create_image(instance.id, name=tag, description=tag)
-        print('Creating AMI image %s..' % image_id, end='')
-        # There can be a delay before AWS knows about the new image ID
-        time.sleep(10)
-        sys.stdout.flush()
-        image = ec2_conn.get_image(image_id)
-        image.add_tag('Name', tag)
-        image.add_tag('StormBench', 'True')
-        while image.state != 'available':
-            print('.', end='')
-            sys.stdout.flush()
-            image.update()
-            time.sleep(5)
-        print(' Image created.')
-        snapshot_id = image.block_device_mapping.get('/dev/sda1', None)
-        if snapshot_id:
-            snapshot_id = snapshot_id.snapshot_id
-        if snapshot_id:
-            print('Tagging AMI snapshot %s...' % snapshot_id)
-            for snapshot in ec2_conn.get_all_snapshots(snapshot_ids=[snapshot_id]):
-                snapshot.add_tag('Name', tag)
-                snapshot.add_tag('StormBench', 'True')
-        
-        # All done, we can terminate the Redis server and the instances.
-        print('Terminating temporary instance %s' % (instance.id))
-        terminate_instances(ec2_conn, [instance], price_manager)
-        terminate_redis_server(ec2_conn, args, price_manager)
-        price_manager.report()
+    # Wait for the client to register on the Redis server.
+    redis_manager.wait_for_clients([instance.id])
     
-    def status(self, args):
-        print('Resources currently used by StormBench on EC2:')
-        price_manager = PriceManager(args.region)
-        n_instances = 0
-        n_images = 0
-        n_snapshots = 0
-        n_groups = 0
-        ec2_conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
-        for reservation in ec2_conn.get_all_instances(filters={'tag:StormBench':'True'}):
-            for instance in reservation.instances:
-                if instance.tags['StormBench'] == 'True' and instance.state != 'terminated':
-                    price = price_manager.get_instance_price(instance)
-                    print('Instance %s %s %s %s %s %s $%.03f/h' % (instance.id, instance.tags.get('Name', '(unnamed)'), instance.instance_type, instance.state, instance.public_dns_name, instance.private_dns_name, price))
-                    n_instances += 1
-        for image in ec2_conn.get_all_images(owners=['self'], filters={'tag:StormBench':'True'}):
-            if image.tags['StormBench'] == 'True':
-                print('Image %s %s %s' % (image.id, image.name, image.tags.get('Name', '(unnamed)')))
-                n_images += 1
-        for snapshot in ec2_conn.get_all_snapshots(filters={'tag:StormBench':'True'}):
-            if image.tags['StormBench'] == 'True':
-                print('Snapshot %s %s' % (image.id, image.tags.get('Name', '(unnamed)')))
-                n_snapshots += 1
+    # Now we can create the AMI image.
+    image_id = ec2_conn.create_image(instance.id, name=tag, description=tag)
+    print('Creating AMI image %s...' % image_id)
+    # There can be a delay before AWS knows about the new image ID
+    time.sleep(10)
+    image = ec2_conn.get_image(image_id)
+    # Apply both tags with a single CreateTags API call
+    ec2_conn.create_tags([image_id], {'Name': tag, 'StormBench': 'True'})
+    # AMI creation takes minutes, so a long floor and ceiling avoid
+    # burning describe calls that cannot possibly observe a change
+    wait_for_state(image, 'available', initial_delay=15, max_delay=60)
+    print('Image created.')
+    snapshot_id = image.block_device_mapping.get('/dev/sda1', None)
+    if snapshot_id:
+        snapshot_id = snapshot_id.snapshot_id
+    if snapshot_id:
+        print('Tagging AMI snapshot %s...' % snapshot_id)
+        # CreateTags accepts the raw id, so no DescribeSnapshots round-trip
+        # is needed just to obtain a Snapshot object to tag
+        ec2_conn.create_tags([snapshot_id], {'Name': tag, 'StormBench': 'True'})
+    # The cached image listing is now stale; drop it so the next command
+    # picks up the new AMI
+    _cache_invalidate('images-%s-%s' % (args.region, args.key))
+    
+    # All done, we can terminate the Redis server and the instances.
+    print('Terminating temporary instance %s' % (instance.id))
+    terminate_instances(ec2_conn, [instance], price_manager)
+    terminate_redis_server(ec2_conn, args, price_manager)
+    price_manager.report()
+
+def status(args):
+    print('Resources currently used by StormBench on EC2:')
+    price_manager = PriceManager(args.region)
+    n_instances = 0
+    n_images = 0
+    n_snapshots = 0
+    n_groups = 0
+    def get_groups(conn):
         try:
-            for group in ec2_conn.get_all_security_groups(groupnames=[args.group]):
-                print('Security group %s' % (group.name))
-                n_groups += 1
+            return conn.get_all_security_groups(groupnames=[args.group])
         except:
             # Expecting EC2ResponseError if group doesn't exist
-            pass
-        print('Total %d instance(s), %d image(s), %d snapshot(s) and %d security group(s).' % (n_instances, n_images, n_snapshots, n_groups))
-    
-    def cleanup(self, args):
-        print('Scanning for StormBench instances and images...')
-        instances_to_terminate = []
-        images_to_delete = []
-        groups_to_delete = []
-        ec2_conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
-        latest_image = None
-        prev_name = ''
-        for reservation in ec2_conn.get_all_instances(filters={'tag:StormBench':'True'}):
+            return []
+    # One DescribeTags call finds every StormBench resource regardless of
+    # type, replacing the three per-type describe calls; it runs
+    # concurrently with the group probe. The filter stays narrow because
+    # DescribeTags caps the reply at 1000 tags, which an account-wide
+    # Name listing could easily exceed.
+    describes = describe_in_parallel(args, {
+        'tags': lambda conn: conn.get_all_tags(filters={'key': 'StormBench', 'value': 'True'}),
+        'groups': get_groups,
+    })
+    tagged_ids = {}
+    for tag in describes['tags']:
+        tagged_ids.setdefault(tag.res_type, set()).add(tag.res_id)
+    # Fetch display names with a second DescribeTags scoped to just the
+    # discovered resources, so only StormBench Name tags come back
+    names = {}
+    ec2_conn = get_ec2_conn(args)
+    all_ids = sorted(set().union(*tagged_ids.values())) if tagged_ids else []
+    if all_ids:
+        for tag in ec2_conn.get_all_tags(filters={'resource-id': all_ids, 'key': 'Name'}):
+            names[tag.res_id] = tag.value
+    # Only instances need a follow-up describe, for state, addresses and
+    # pricing; image and snapshot ids plus Name tags suffice for display
+    instance_ids = sorted(tagged_ids.get('instance', ()))
+    if instance_ids:
+        for reservation in ec2_conn.get_all_instances(instance_ids=instance_ids):
             for instance in reservation.instances:
-                if instance.tags['StormBench'] == 'True' and instance.state != 'terminated' and instance.state != 'shutting-down':
-                    instances_to_terminate.append(instance)
-        for image in ec2_conn.get_all_images(owners=['self'], filters={'tag:StormBench':'True'}):
-            if image.tags['StormBench'] == 'True':
-                images_to_delete.append(image)
-                if image.name > prev_name:
-                    latest_image = image
-                    prev_name = image.name
-        if latest_image and not args.full:
-            # Keep the latest image
-            print('Keeping latest AMI image %s %s' % (latest_image.id, latest_image.name))
-            images_to_delete.remove(latest_image)
+                if instance.state != 'terminated':
+                    price = price_manager.get_instance_price(instance)
+                    print('Instance %s %s %s %s %s %s $%.03f/h' % (instance.id, names.get(instance.id, '(unnamed)'), instance.instance_type, instance.state, instance.public_dns_name, instance.private_dns_name, price))
+                    n_instances += 1
+    for image_id in sorted(tagged_ids.get('image', ())):
+        print('Image %s %s' % (image_id, names.get(image_id, '(unnamed)')))
+        n_images += 1
+    for snapshot_id in sorted(tagged_ids.get('snapshot', ())):
+        print('Snapshot %s %s' % (snapshot_id, names.get(snapshot_id, '(unnamed)')))
+        n_snapshots += 1
+    for group in describes['groups']:
+        print('Security group %s' % (group.name))
+        n_groups += 1
+    print('Total %d instance(s), %d image(s), %d snapshot(s) and %d security group(s).' % (n_instances, n_images, n_snapshots, n_groups))
+
+def cleanup(args):
+    print('Scanning for StormBench instances and images...')
+    instances_to_terminate = []
+    images_to_delete = []
+    groups_to_delete = []
+    ec2_conn = get_ec2_conn(args)
+    latest_image = None
+    prev_name = ''
+    def get_groups(conn):
         try:
-            for group in ec2_conn.get_all_security_groups(groupnames=[args.group]):
-                groups_to_delete.append(group)
+            return conn.get_all_security_groups(groupnames=[args.group])
         except:
             # Expecting EC2ResponseError if group doesn't exist
-            pass
-        if not instances_to_terminate and not images_to_delete and not groups_to_delete:
-            print('Nothing to clean up.')
-            return
-        for instance in instances_to_terminate:
-            print('Terminating instance %s %s %s %s %s %s' % (instance.id, instance.tags.get('Name', '(unnamed)'), instance.instance_type, instance.state, instance.public_dns_name, instance.private_dns_name))
-        for image in images_to_delete:
-            print('Deleting image %s %s %s' % (image.id, image.name, image.tags.get('Name', '(unnamed)')))
-        for group in groups_to_delete:
-            print('Deleting security group %s' % (group.name))
-        print('About to terminate %d instance(s), delete %d image(s) and delete %d security group(s).' % (len(instances_to_terminate), len(images_to_delete), len(groups_to_delete)))
-        print('Do you want to continue? [Ny]', end='')
-        sys.stdout.flush()
-        answer = sys.stdin.readline().strip()
-        if answer not in ('y', 'Y'):
-            print('Aborted.')
-            return
-        print('Cleaning up now...')
-        for instance in instances_to_terminate:
-            print('Terminating instance %s %s' % (instance.id, instance.tags.get('Name', '(unnamed)')))
-        terminate_instances(ec2_conn, instances_to_terminate)
-        for image in images_to_delete:
-            print('Deleting image %s %s %s...' % (image.id, image.name, image.tags.get('Name', '(unnamed)')))
-            image.deregister(delete_snapshot=True)
-        for group in groups_to_delete:
-            print('Deleting security group %s...' % (group.name))
-            group.delete()
-        print('Ready.')
-    
-    def benchmark(self, args):
-        tag = args.prefix + '-client'
-        
-        print('Preparing to run benchmark...')
-        print('    Account: %s' % args.key)
-        print('    Region: %s' % args.region)
-        print('    Instance type: %s' % args.type)
-        print('    Tag: %s' % tag)
-        
-        price_manager = PriceManager(args.region)
-        ec2_conn = connect_to_region(args.region, aws_access_key_id=args.key, aws_secret_access_key=args.secret)
-        auto_choose_ami(ec2_conn, args)
-        create_security_group(ec2_conn, args)
-        server_address = launch_redis_server(ec2_conn, args, price_manager)
-        redis_manager = RedisManager(server_address)
-        redis_manager.reset_data()
-        ab_command_line = '/usr/bin/ab -n %d -c %d %s %s' % (args.numrequests, args.concurrency, args.options, args.url)
-        user_data = make_client_user_data(server_address, ab_command_line)
-        
-        print('Ready to start benchmarking.')
-        print('    URL: %s' % (args.url))
-        print('    Instance count: %d' % (args.instances))
-        print('    Number of requests: %d' % (args.numrequests))
-        print('    Concurrency: %d' % (args.concurrency))
-        print('    Additional options: %s' % (args.options))
-        print('    Full ab command: %s' % (ab_command_line))
-        
-        # Now we can launch the instances.
-        instances = []
-        for n in xrange(0, args.instances):
-            reservation = ec2_conn.run_instances(image_id=args.ami, instance_type=args.type, user_data=user_data, key_name=args.keypair, security_groups=[args.group])
-            instances.append(reservation.instances[0])
-            price_manager.track(reservation.instances[0])
-        
-        # Wait a moment to let them initialize, and then tag them.
-        time.sleep(10)
-        for instance in instances:
-            instance.add_tag('Name', tag)
-            instance.add_tag('StormBench', 'True')
-        
-        # Wait until all instances have registered on the server.
-        redis_manager.wait_for_clients([instance.id for instance in instances])
-        
-        # Trigger the benchmark everywhere NOW!
-        redis_manager.trigger()
-        
-        # Wait for results from each client.
-        results = redis_manager.wait_for_results([instance.id for instance in instances])
-        
-        # All done.
-        print('Benchmark ready.')
-        redis_manager.print_results(results)
-        
-        # Terminate all client instances now.
-        terminate_instances(ec2_conn, instances, price_manager)
-        price_manager.report()
-
-def main():
-    parser = argparse.ArgumentParser(usage=USAGE)
-    parser.add_argument('command', type=str, choices=('startserver', 'stopserver', 'createimage', 'benchmark', 'status', 'cleanup'))
-    parser.add_argument('url', type=str, default='', nargs='?')
-    parser.add_argument('-r', '--region', type=str, default='eu-west-1')
-    parser.add_argument('-a', '--ami', type=str, default='')
-    parser.add_argument('-p', '--prefix', type=str, default='stormbench')
-    parser.add_argument('-t', '--type', type=str, default='m1.medium')
-    parser.add_argument('-k', '--key', type=str, required=True)
-    parser.add_argument('-e', '--keypair', type=str, default=None)
-    parser.add_argument('-s', '--secret', type=str, required=True)
-    parser.add_argument('-g', '--group', type=str, default='stormbench')
-    parser.add_argument('-f', '--full', action='store_true')
-    parser.add_argument('-i', '--instances', type=int, default=1)
-    parser.add_argument('-n', '--numrequests', type=int, default=1)
-    parser.add_argument('-c', '--concurrency', type=int, default=1)
-    parser.add_argument('-o', '--options', type=str, default='')
-    args = parser.parse_args()
-    if args.command == 'benchmark' and not args.url:
-        print(parser.usage)
-        print('URL is required')
+            return []
+    # Run the three independent describe calls concurrently
+    describes = describe_in_parallel(args, {
+        'instances': lambda conn: conn.get_all_instances(filters={'tag:StormBench':'True'}),
+        'images': lambda conn: conn.get_all_images(owners=['self'], filters={'tag:StormBench':'True'}),
+        'groups': get_groups,
+    })
+    for reservation in describes['instances']:
+        for instance in reservation.instances:
+            if instance.tags['StormBench'] == 'True' and instance.state != 'terminated' and instance.state != 'shutting-down':
+                instances_to_terminate.append(instance)
+    for image in describes['images']:
+        if image.tags['StormBench'] == 'True':
+            images_to_delete.append(image)
+            if image.name > prev_name:
+                latest_image = image
+                prev_name = image.name
+    if latest_image and not args.full:
+        # Keep the latest image
+        print('Keeping latest AMI image %s %s' % (latest_image.id, latest_image.name))
+        images_to_delete.remove(latest_image)
+    groups_to_delete.extend(describes['groups'])
+    if not instances_to_terminate and not images_to_delete and not groups_to_delete:
+        print('Nothing to clean up.')
+        return
+    for instance in instances_to_terminate:
+        print('Terminating instance %s %s %s %s %s %s' % (instance.id, instance.tags.get('Name', '(unnamed)'), instance.instance_type, instance.state, instance.public_dns_name, instance.private_dns_name))
+    for image in images_to_delete:
+        print('Deleting image %s %s %s' % (image.id, image.name, image.tags.get('Name', '(unnamed)')))
+    for group in groups_to_delete:
+        print('Deleting security group %s' % (group.name))
+    print('About to terminate %d instance(s), delete %d image(s) and delete %d security group(s).' % (len(instances_to_terminate), len(images_to_delete), len(groups_to_delete)))
+    print('Do you want to continue? [Ny]', end='')
+    sys.stdout.flush()
+    answer = sys.stdin.readline().strip()
+    if answer not in ('y', 'Y'):
+        print('Aborted.')
         return
-    logging.basicConfig(level=logging.CRITICAL)
-    # The Commands class contains the various commands
-    commands = Commands()
-    getattr(commands, args.command)(args)
+    print('Cleaning up now...')
+    for instance in instances_to_terminate:
+        print('Terminating instance %s %s' % (instance.id, instance.tags.get('Name', '(unnamed)')))
+    terminate_instances(ec2_conn, instances_to_terminate)
+    for image in images_to_delete:
+        print('Deleting image %s %s %s...' % (image.id, image.name, image.tags.get('Name', '(unnamed)')))
+        image.deregister(delete_snapshot=True)
+    for group in groups_to_delete:
+        print('Deleting security group %s...' % (group.name))
+        group.delete()
+    _cache_invalidate('images-%s-%s' % (args.region, args.key), 'group-%s-%s-%s' % (args.region, args.key, args.group))
+    print('Ready.')
 
-USAGE = re.sub(r'^    ', '', """
-    StormBench 1.0 (C) Kenneth Falck <kennu@iki.fi> 2012
-    
-    Usage: stormbench.py [options] <command> [arguments]
-    
-    Commands:
-    
-    stormbench.py [options] createimage
-    
-        Creates a new AMI client image using a base Ubuntu image. This will
-        launch a temporary EC2 instance which is terminated at the end.
-    
-        -a ami-c7aaabb3
-        --ami ami-c7aaabb3    Base AMI image. This will default to the
-                              Ubuntu 12.04 EBS 32-bit AMI for the active
-                              region. See this URL for a list of images:
-                              http://cloud-images.ubuntu.com/releases/precise/release/
-        -t m1.large
-        --type m1.large       EC2 instance type to use. Default: m1.medium.
-    
-    stormbench.py [options] benchmark <url>
-    
-        Runs a benchmark for the specified URL.
-    
-        <url>                 The URL to test. REQUIRED
-        -i 100
-        --instances 100       Number of client instances to start. Default: 1
-        -n 1000
-        --numrequests         Number of requests/client to make. Default: 1
-        -c 50
-        --concurrency 50      Concurrency of each client. Default: 1
-        -o <options>
-        --options <options>   Specify additional options for ApacheBench.
-                              See man ab(1) for more information.
-        -a ami-xxxxxxxx
-        --ami ami-xxxxxxxx    AMI image of client instances. The default
-                              is automatically detected based on the tag
-                              prefix of a previously generated image.
-        -t m1.large
-        --type m1.large       EC2 instance type to use. Default: m1.medium.
+def benchmark(args):
+    try:
+        args.instances = int(args.instances)
+        args.numrequests = int(args.numrequests)
+        args.concurrency = int(args.concurrency)
+    except ValueError:
+        print_usage()
+        print('Options --instances, --numrequests and --concurrency require integer values')
+        return 2
+    tag = args.prefix + '-client'
+
+    print('Preparing to run benchmark...')
+    print('    Account: %s' % args.key)
+    print('    Region: %s' % args.region)
+    print('    Instance type: %s' % args.type)
+    print('    Tag: %s' % tag)
     
-    stormbench.py [options] status
+    price_manager = PriceManager(args.region)
+    ec2_conn = get_ec2_conn(args)
+    auto_choose_ami(ec2_conn, args)
+    create_security_group(ec2_conn, args)
+    server_address = launch_redis_server(ec2_conn, args, price_manager)
+    redis_manager = RedisManager(server_address)
+    redis_manager.reset_data()
+    ab_command_line = '/usr/bin/ab -n %d -c %d %s %s' % (args.numrequests, args.concurrency, args.options or '', args.url)
+    user_data = make_client_user_data(server_address, ab_command_line)
     
-        Shows the current status and EC2 resources used by StormBench.
+    print('Ready to start benchmarking.')
+    print('    URL: %s' % (args.url))
+    print('    Instance count: %d' % (args.instances))
+    print('    Number of requests: %d' % (args.numrequests))
+    print('    Concurrency: %d' % (args.concurrency))
+    print('    Additional options: %s' % (args.options or ''))
+    print('    Full ab command: %s' % (ab_command_line))
     
-    stormbench.py [options] cleanup
+    # Now we can launch all the instances with a single API call.
+    reservation = ec2_conn.run_instances(image_id=args.ami, min_count=args.instances, max_count=args.instances, instance_type=args.type, user_data=user_data, key_name=args.keypair, security_groups=[args.group])
+    instances = list(reservation.instances)
+    instance_ids = [instance.id for instance in instances]
+    for instance in instances:
+        price_manager.track(instance)
+
+    # Wait a moment to let them initialize, and then tag them all with a single CreateTags API call.
+    time.sleep(10)
+    ec2_conn.create_tags(instance_ids, {'Name': tag, 'StormBench': 'True'})
+
+    # Wait until all instances have registered on the server.
+    redis_manager.wait_for_clients(instance_ids)
+
+    # Trigger the benchmark everywhere NOW!
+    redis_manager.trigger(len(instance_ids))
+
+    # Wait for results from each client.
+    results = redis_manager.wait_for_results(instance_ids)
     
-        Cleans up all resources on EC2 that were created by StormBench.
-        This command will ask for confirmation before proceeding.
-        
-        -f
-        --full                Full cleanup, also delete latest AMI.
+    # All done.
+    print('Benchmark ready.')
+    redis_manager.print_results(results)
     
-    Common options:
+    # Terminate all client instances now.
+    terminate_instances(ec2_conn, instances, price_manager)
+    price_manager.report()
+
+
+# Dispatch table of the command line commands
+COMMANDS = {
+    'startserver': startserver,
+    'stopserver': stopserver,
+    'createimage': createimage,
+    'benchmark': benchmark,
+    'status': status,
+    'cleanup': cleanup,
+}
+
+# Command line options, one row each: (short name, long name, default, is_flag)
+_OPTION_SPEC = (
+    ('r', 'region', 'eu-west-1', False),
+    ('a', 'ami', None, False),
+    ('p', 'prefix', 'stormbench', False),
+    ('t', 'type', 'm1.medium', False),
+    ('k', 'key', os.environ.get('AWS_ACCESS_KEY_ID'), False),
+    ('e', 'keypair', None, False),
+    ('s', 'secret', os.environ.get('AWS_SECRET_ACCESS_KEY'), False),
+    ('g', 'group', 'stormbench', False),
+    ('f', 'full', False, True),
+    ('i', 'instances', 1, False),
+    ('n', 'numrequests', 1, False),
+    ('c', 'concurrency', 1, False),
+    ('o', 'options', None, False),
+)
+
+# Lookup views derived from the spec once at import
+_SHORT_TO_LONG = dict((short, long_name) for short, long_name, _default, _is_flag in _OPTION_SPEC)
+_FLAG_OPTIONS = frozenset(long_name for _short, long_name, _default, is_flag in _OPTION_SPEC if is_flag)
+_OPTION_DEFAULTS = dict((long_name, default) for _short, long_name, default, _is_flag in _OPTION_SPEC)
+
+class Args(object):
+    """
+    Holder for the parsed command line.
+    __slots__ keeps attribute access a fixed-offset load instead of a
+    dict probe, and rejects typoed attribute names outright.
+    """
+    __slots__ = ('command', 'url') + tuple(_OPTION_DEFAULTS)
+
+    def __init__(self):
+        self.command = None
+        self.url = None
+        for name, value in _OPTION_DEFAULTS.items():
+            setattr(self, name, value)
+
+def parse_args(argv):
+    """
+    Parse the command line with a single linear scan over argv.
+    The option set is small and fixed, so a hand-rolled scanner avoids
+    argparse's per-invocation parser and action setup; we ship our own
+    usage text, so its help machinery brings nothing either.
+    Returns the parsed Args, or None after printing a usage error.
+    """
+    args = Args()
+    positionals = []
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        index += 1
+        if arg.startswith('--'):
+            if '=' in arg:
+                name, value = arg[2:].split('=', 1)
+            else:
+                name, value = arg[2:], None
+        elif arg.startswith('-') and len(arg) > 1:
+            name, value = _SHORT_TO_LONG.get(arg[1:], arg[1:]), None
+        else:
+            positionals.append(arg)
+            continue
+        if name not in _OPTION_DEFAULTS:
+            print_usage()
+            print('Unknown option: %s' % arg)
+            return None
+        if name in _FLAG_OPTIONS:
+            setattr(args, name, True)
+            continue
+        if value is None:
+            if index >= len(argv):
+                print_usage()
+                print('Option %s requires a value' % arg)
+                return None
+            value = argv[index]
+            index += 1
+        # Numeric options stay as strings here; the handler that actually
+        # uses them converts (and validates) them
+        setattr(args, name, value)
+    if not positionals or positionals[0] not in COMMANDS:
+        print_usage()
+        print('Unknown command: %s' % (positionals[0] if positionals else '(none)'))
+        return None
+    args.command = positionals[0]
+    if len(positionals) > 1:
+        args.url = positionals[1]
+    if args.command == 'benchmark' and not args.url:
+        print_usage()
+        print('URL is required')
+        return None
+    return args
+
+def main():
+    # Answer -h/--help before doing any parsing work at all
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print_usage()
+        return
+    args = parse_args(sys.argv[1:])
+    if args is None:
+        # Usage error; return nonzero so shell scripts notice
+        return 2
+    if not args.key or not args.secret:
+        print_usage()
+        print('AWS credentials are required; pass --key/--secret or set')
+        print('AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY in the environment')
+        return 2
+    if args.type not in INSTANCE_TYPES:
+        print_usage()
+        print('Unknown instance type: %s' % args.type)
+        return 2
+    if args.region not in REGIONS:
+        print_usage()
+        print('Unknown region: %s' % args.region)
+        return 2
+    # Look up the command handler in the dispatch table; handlers may
+    # return their own exit status, which falls through to sys.exit
+    return COMMANDS[args.command](args)
+
+# Pre-dedented so no regex pass runs at import time
+USAGE = """
+StormBench 1.0 (C) Kenneth Falck <kennu@iki.fi> 2012
+
+Usage: stormbench.py [options] <command> [arguments]
+
+Commands:
+
+stormbench.py [options] createimage
+
+    Creates a new AMI client image using a base Ubuntu image. This will
+    launch a temporary EC2 instance which is terminated at the end.
+
+    -a ami-c7aaabb3
+    --ami ami-c7aaabb3    Base AMI image. This will default to the
+                          Ubuntu 12.04 EBS 32-bit AMI for the active
+                          region. See this URL for a list of images:
+                          http://cloud-images.ubuntu.com/releases/precise/release/
+    -t m1.large
+    --type m1.large       EC2 instance type to use. Default: m1.medium.
+
+stormbench.py [options] benchmark <url>
+
+    Runs a benchmark for the specified URL.
+
+    <url>                 The URL to test. REQUIRED
+    -i 100
+    --instances 100       Number of client instances to start. Default: 1
+    -n 1000
+    --numrequests         Number of requests/client to make. Default: 1
+    -c 50
+    --concurrency 50      Concurrency of each client. Default: 1
+    -o <options>
+    --options <options>   Specify additional options for ApacheBench.
+                          See man ab(1) for more information.
+    -a ami-xxxxxxxx
+    --ami ami-xxxxxxxx    AMI image of client instances. The default
+                          is automatically detected based on the tag
+                          prefix of a previously generated image.
+    -t m1.large
+    --type m1.large       EC2 instance type to use. Default: m1.medium.
+
+stormbench.py [options] status
+
+    Shows the current status and EC2 resources used by StormBench.
+
+stormbench.py [options] cleanup
+
+    Cleans up all resources on EC2 that were created by StormBench.
+    This command will ask for confirmation before proceeding.
     
-        -k
-        --key                 AWS access key to use. REQUIRED
-        -s
-        --secret              AWS secret access key to use. REQUIRED
-        -r us-east-1
-        --region us-east-1    AWS region to use. Default: eu-west-1
-        -p tag-prefix
-        --prefix tag-prefix   AWS tag prefix. Default: stormbench
-        -e key-name
-        --keypair key-name    AWS keypair to use. Default: None
-        -g sec-group
-        --group sec-group     AWS security group. Default: stormbench
-    """, flags=re.M)
+    -f
+    --full                Full cleanup, also delete latest AMI.
+
+Common options:
+
+    -k
+    --key                 AWS access key to use. REQUIRED
+    -s
+    --secret              AWS secret access key to use. REQUIRED
+    -r us-east-1
+    --region us-east-1    AWS region to use. Default: eu-west-1
+    -p tag-prefix
+    --prefix tag-prefix   AWS tag prefix. Default: stormbench
+    -e key-name
+    --keypair key-name    AWS keypair to use. Default: None
+    -g sec-group
+    --group sec-group     AWS security group. Default: stormbench
+"""
+
+# Usage text encoded once at import; writing the bytes straight to the
+# byte stream skips the stdout encoder setup on the help/error path
+USAGE_BYTES = USAGE.encode('utf-8')
+
+def print_usage():
+    stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    stream.write(USAGE_BYTES)
+    stream.write(b'\n')
+    stream.flush()
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main() or 0)